@@ -0,0 +1,57 @@
+"""Per-interaction cost of a cart quantity change: redirect + full render vs JSON.
+
+"form" is the plain POST /cart/update -> 302 -> GET /cart round trip the page
+used to make on every change; "fetch" is the same POST with
+Accept: application/json. Reports mean latency and response bytes.
+
+    SESSION_SECRET=x DATABASE_URL=sqlite:////tmp/bench_cart.db python benchmarks/cart_fragments.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import app
+from models import db, Product
+
+CART_LINES = int(os.environ.get('CART_LINES', 10))
+ROUNDS = int(os.environ.get('ROUNDS', 300))
+
+app.config['RATELIMIT_ENABLED'] = False
+
+with app.app_context():
+    missing = CART_LINES - Product.query.count()
+    for i in range(max(missing, 0)):
+        db.session.add(Product(name=f'Producto {i}', description='Descripción ' * 20, price=9.99, stock=10**6))
+    db.session.commit()
+    product_ids = [product.id for product in Product.query.limit(CART_LINES)]
+
+client = app.test_client()
+for product_id in product_ids:
+    client.post(f'/cart/add/{product_id}', data={'quantity': 1})
+
+
+def form_interaction(quantity):
+    response = client.post(f'/cart/update/{product_ids[0]}', data={'quantity': quantity})
+    size = len(response.get_data())
+    response = client.get(response.headers['Location'])
+    return size + len(response.get_data()), 2
+
+
+def fetch_interaction(quantity):
+    response = client.post(f'/cart/update/{product_ids[0]}', data={'quantity': quantity},
+                           headers={'Accept': 'application/json'})
+    return len(response.get_data()), 1
+
+
+for name, interaction in (('form', form_interaction), ('fetch', fetch_interaction)):
+    interaction(2)
+    total_bytes = 0
+    start = time.perf_counter()
+    for i in range(ROUNDS):
+        size, requests = interaction(1 + i % 5)
+        total_bytes += size
+    elapsed = time.perf_counter() - start
+    print(f'{name:6} requests/interaction={requests} '
+          f'latency={elapsed / ROUNDS * 1000:.2f} ms bytes/interaction={total_bytes // ROUNDS}')
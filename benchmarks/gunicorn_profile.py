@@ -0,0 +1,91 @@
+"""Compare the bare `gunicorn main:app` start with the gunicorn.conf.py profile.
+
+Starts each configuration on a local port, drives GET / with concurrent
+clients and reports requests/second plus per-worker RSS and PSS (PSS splits
+shared copy-on-write pages between the processes that map them).
+
+    SESSION_SECRET=x DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/gunicorn_profile.py
+"""
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PORT = 8765
+REQUESTS = int(os.environ.get('BENCH_REQUESTS', 2000))
+CLIENTS = int(os.environ.get('BENCH_CLIENTS', 16))
+WORKERS = os.environ.get('BENCH_WORKERS', '4')
+
+PROFILES = {
+    'bare': ['gunicorn', '--config', '/dev/null', '--workers', WORKERS,
+             '--bind', f'127.0.0.1:{PORT}', 'main:app'],
+    'profile': ['gunicorn', '--config', 'gunicorn.conf.py', '--workers', WORKERS,
+                '--bind', f'127.0.0.1:{PORT}', 'main:app'],
+}
+
+
+def memory_kb(pid):
+    rss = pss = 0
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            if line.startswith('Rss:'):
+                rss = int(line.split()[1])
+            elif line.startswith('Pss:'):
+                pss = int(line.split()[1])
+    return rss, pss
+
+
+def worker_pids(master_pid):
+    with open(f'/proc/{master_pid}/task/{master_pid}/children') as f:
+        return [int(pid) for pid in f.read().split()]
+
+
+def fetch(_):
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{PORT}/') as response:
+            response.read()
+        return True
+    except OSError:
+        return False
+
+
+def wait_until_up():
+    for _ in range(100):
+        if fetch(None):
+            return
+        time.sleep(0.1)
+    raise RuntimeError('gunicorn did not start')
+
+
+def run(name, command):
+    env = dict(os.environ, RATELIMIT_ENABLED='False')
+    proc = subprocess.Popen(command, cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_up()
+        with ThreadPoolExecutor(CLIENTS) as pool:
+            list(pool.map(fetch, range(200)))
+            start = time.perf_counter()
+            ok = sum(pool.map(fetch, range(REQUESTS)))
+            elapsed = time.perf_counter() - start
+        usage = [memory_kb(pid) for pid in worker_pids(proc.pid)]
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    rss = sum(r for r, _ in usage) / len(usage) / 1024
+    pss = sum(p for _, p in usage) / len(usage) / 1024
+    print(f'{name:8} workers={len(usage)} req/s={ok / elapsed:8.1f} errors={REQUESTS - ok} '
+          f'rss/worker={rss:6.1f} MiB pss/worker={pss:6.1f} MiB')
+
+
+if __name__ == '__main__':
+    # Create tables and defaults up front; without preload_app every bare
+    # worker races to insert the default admin on an empty database.
+    subprocess.run([sys.executable, '-c', 'import main'], cwd=ROOT, check=True,
+                   stdout=subprocess.DEVNULL)
+    for name in sys.argv[1:] or PROFILES:
+        run(name, PROFILES[name])
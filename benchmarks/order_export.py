@@ -0,0 +1,51 @@
+"""Export ORDER_LINES order lines (default 1M) and check memory stays bounded.
+
+Streams the admin CSV and JSONL exports through the test client and fails if
+the Python heap peak exceeds MAX_PEAK_MIB while doing so.
+
+    SESSION_SECRET=x DATABASE_URL=sqlite:////tmp/bench_reco.db python benchmarks/order_export.py
+
+Reuses the order history generated by benchmarks/recommendations.py.
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func, select
+
+from main import app
+from models import db, OrderItem
+
+ORDER_LINES = int(os.environ.get('ORDER_LINES', 1_000_000))
+MAX_PEAK_MIB = float(os.environ.get('MAX_PEAK_MIB', 32))
+
+app.config['RATELIMIT_ENABLED'] = False
+
+with app.app_context():
+    lines = db.session.scalar(select(func.count(OrderItem.id)))
+    if lines < ORDER_LINES:
+        sys.exit(f'only {lines} order lines; run benchmarks/recommendations.py first')
+
+client = app.test_client()
+with client.session_transaction() as session:
+    session['admin_logged_in'] = True
+
+for export_format in ('csv', 'jsonl'):
+    tracemalloc.start()
+    start = time.perf_counter()
+    response = client.get(f'/admin/orders/export/download?format={export_format}', buffered=False)
+    size = rows = 0
+    for chunk in response.response:
+        size += len(chunk)
+        rows += chunk.count(b'\n')
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    response.close()
+
+    print(f'{export_format:5} rows={rows} size={size / 2**20:.0f} MiB in {elapsed:.1f}s peak heap={peak:.1f} MiB')
+    assert rows >= ORDER_LINES, rows
+    assert peak < MAX_PEAK_MIB, f'peak heap {peak:.1f} MiB exceeds {MAX_PEAK_MIB} MiB'
@@ -0,0 +1,150 @@
+"""Check monthly order partitioning, partition pruning and archival on PostgreSQL.
+
+Builds ORDERS orders (default 300k, two lines each) spread over the last
+MONTHS months in plain tables, converts them to partitioned tables, checks
+that the admin export query (exports.order_lines_query) for the last month
+only touches the current partitions, then archives old months to the
+*_archive tables and to gzipped CSV.
+
+    SESSION_SECRET=x DATABASE_URL=postgresql://.../scratch python benchmarks/order_partitions.py
+
+Drops and recreates orders/order_items: point it at a scratch database.
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import inspect, text
+
+from exports import order_lines_query
+from main import app, ensure_schema
+from models import db
+from partitioning import (
+    PARTITIONED_TABLES, archive_orders, convert_to_partitioned, ensure_partitions, list_partitions,
+    _add_months, _month_start,
+)
+
+ORDERS = int(os.environ.get('ORDERS', 300_000))
+MONTHS = int(os.environ.get('MONTHS', 36))
+
+
+def scanned_tables(conn, stmt):
+    compiled = stmt.compile(dialect=conn.dialect)
+    plan = conn.exec_driver_sql(f'EXPLAIN (FORMAT JSON) {compiled.string}', compiled.params).scalar()
+    plan = plan if isinstance(plan, list) else json.loads(plan)
+    tables = set()
+    nodes = [plan[0]['Plan']]
+    while nodes:
+        node = nodes.pop()
+        if 'Relation Name' in node:
+            tables.add(node['Relation Name'])
+        nodes.extend(node.get('Plans', []))
+    return tables
+
+
+def timed_ms(conn, stmt):
+    start = time.perf_counter()
+    rows = conn.execute(stmt).all()
+    return len(rows), (time.perf_counter() - start) * 1000
+
+
+def table_count(conn, name):
+    return conn.execute(text(f'SELECT count(*) FROM "{name}"')).scalar()
+
+
+with app.app_context():
+    if db.engine.dialect.name != 'postgresql':
+        sys.exit('partitioning needs PostgreSQL; set DATABASE_URL')
+
+    with db.engine.begin() as conn:
+        for table in reversed(PARTITIONED_TABLES):
+            conn.execute(text(f'DROP TABLE IF EXISTS "{table.name}", "{table.name}_archive" CASCADE'))
+        db.metadata.create_all(conn, tables=PARTITIONED_TABLES)
+        # Tables from before partitioning had no order_items.created_at.
+        conn.execute(text('ALTER TABLE order_items DROP COLUMN created_at'))
+        if not conn.execute(text('SELECT count(*) FROM products')).scalar():
+            conn.execute(text(
+                "INSERT INTO products (name, description, price, stock, reserved) "
+                "SELECT 'Producto ' || n, 'bench', 10, 100, 0 FROM generate_series(1, 100) n"
+            ))
+        product_ids = conn.execute(text('SELECT min(id), max(id) FROM products')).one()
+        start = time.perf_counter()
+        conn.execute(text(
+            "INSERT INTO orders (id, payment_method, total_amount, status, created_at) "
+            "SELECT n, 'paypal', 20, 'paid', now() - (:months * interval '1 month') * n / :orders "
+            "FROM generate_series(1, :orders) n"
+        ), {'orders': ORDERS, 'months': MONTHS - 1})
+        conn.execute(text(
+            "INSERT INTO order_items (order_id, product_id, quantity, unit_price, subtotal) "
+            "SELECT o.id, :low + (o.id * line) % (:high - :low + 1), 1, 10, 10 "
+            "FROM orders o CROSS JOIN generate_series(1, 2) line"
+        ), {'low': product_ids[0], 'high': product_ids[1]})
+        conn.execute(text("SELECT setval('orders_id_seq', :orders)"), {'orders': ORDERS})
+        print(f'plain tables: {ORDERS} orders, {2 * ORDERS} lines in {time.perf_counter() - start:.1f}s')
+
+    # Startup adds the missing column and backfills it from the orders.
+    ensure_schema()
+    current = _month_start(datetime.utcnow())
+    recent = order_lines_query(date_from=current)
+    with db.engine.begin() as conn:
+        assert conn.execute(text('SELECT count(*) FROM order_items WHERE created_at IS NULL')).scalar() == 0
+        assert not {c['name']: c for c in inspect(conn).get_columns('order_items')}['created_at']['nullable']
+        conn.execute(text('ANALYZE orders; ANALYZE order_items'))
+        lines, elapsed = timed_ms(conn, recent)
+        print(f'last-month export query on plain tables: {lines} lines in {elapsed:.1f} ms')
+
+    start = time.perf_counter()
+    assert convert_to_partitioned()
+    ensure_schema()
+    with db.engine.begin() as conn:
+        assert ensure_partitions(conn) == [], 'partitions missing after conversion'
+        partitions = {table.name: list_partitions(conn, table.name) for table in PARTITIONED_TABLES}
+        conn.execute(text('ANALYZE orders; ANALYZE order_items'))
+        print(f'converted in {time.perf_counter() - start:.1f}s, '
+              f'{len(partitions["orders"])} monthly partitions per table')
+        assert table_count(conn, 'orders') == ORDERS
+        assert table_count(conn, 'order_items') == 2 * ORDERS
+        assert conn.execute(text('SELECT count(*) FROM order_items_default')).scalar() == 0
+
+        scanned = {name for name in scanned_tables(conn, recent) if name.startswith('order')}
+        expected = {name for table in partitions.values()
+                    for month, name in table.items() if month >= current}
+        print(f'last-month export query scans: {sorted(scanned)}')
+        assert scanned <= expected | {'orders_default', 'order_items_default'}, scanned
+
+        lines, elapsed = timed_ms(conn, recent)
+        print(f'last-month export query on partitions: {lines} lines in {elapsed:.1f} ms')
+
+        # New orders keep landing in the right partition.
+        order_id = conn.execute(text(
+            "INSERT INTO orders (payment_method, total_amount, status, created_at) "
+            "VALUES ('stripe', 5, 'paid', now()) RETURNING id"
+        )).scalar()
+        assert order_id == ORDERS + 1, order_id
+
+    keep_months = MONTHS // 2
+    cutoff = _add_months(current, -keep_months)
+    start = time.perf_counter()
+    archived = archive_orders(keep_months)
+    print(f'archived {len(archived)} partitions older than {cutoff:%Y-%m} in {time.perf_counter() - start:.1f}s')
+    with db.engine.begin() as conn:
+        assert all(month >= cutoff for month in list_partitions(conn, 'orders'))
+        assert table_count(conn, 'orders') + table_count(conn, 'orders_archive') == ORDERS + 1
+        assert table_count(conn, 'order_items') + table_count(conn, 'order_items_archive') == 2 * ORDERS
+        archive = text('SELECT * FROM orders_archive WHERE created_at >= :d').bindparams(d=cutoff)
+        print(f'archive lookup plan: {sorted(scanned_tables(conn, archive))}')
+
+    with tempfile.TemporaryDirectory() as archive_dir:
+        files = archive_orders(keep_months - 1, archive_dir)
+        print(f'wrote {[os.path.basename(path) for path in files]}')
+        assert len(files) == 2 and all(os.path.getsize(path) for path in files)
+        assert archive_orders(keep_months - 1, archive_dir) == []
+        assert sorted(os.listdir(archive_dir)) == sorted(os.path.basename(path) for path in files)
+
+    assert archive_orders(keep_months - 1) == []
+    print('ok')
@@ -0,0 +1,86 @@
+"""Time the co-occurrence build on a synthetic order history.
+
+Generates ORDER_LINES order lines (default 1M) spread over baskets of 1-6
+products, then times a full rebuild and an incremental refresh after 1%
+more orders arrive.
+
+    SESSION_SECRET=x DATABASE_URL=sqlite:////tmp/bench_reco.db python benchmarks/recommendations.py
+"""
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert, func, select
+
+from main import app
+from models import db, Product, Order, OrderItem, ProductPairCount, ProductRecommendation
+from recommendations import refresh_recommendations, rebuild_recommendations
+
+ORDER_LINES = int(os.environ.get('ORDER_LINES', 1_000_000))
+PRODUCTS = int(os.environ.get('PRODUCTS', 2000))
+CHUNK = 20000
+
+
+def generate(lines, first_order_id):
+    rng = random.Random(first_order_id)
+    created = datetime.utcnow() - timedelta(days=1)
+    orders, items = [], []
+    order_id = first_order_id
+    written = 0
+    while written < lines:
+        basket = rng.sample(range(1, PRODUCTS + 1), rng.randint(1, 6))
+        orders.append({'id': order_id, 'payment_method': 'bench', 'total_amount': 0,
+                       'status': 'paid', 'created_at': created})
+        for product_id in basket:
+            items.append({'order_id': order_id, 'product_id': product_id, 'quantity': 1,
+                          'unit_price': 1.0, 'subtotal': 1.0, 'created_at': created})
+        written += len(basket)
+        order_id += 1
+        if len(items) >= CHUNK:
+            db.session.execute(insert(Order), orders)
+            db.session.execute(insert(OrderItem), items)
+            orders, items = [], []
+    if items:
+        db.session.execute(insert(Order), orders)
+        db.session.execute(insert(OrderItem), items)
+    db.session.commit()
+    return order_id
+
+
+with app.app_context():
+    if Product.query.count() < PRODUCTS:
+        db.session.execute(insert(Product), [
+            {'name': f'Producto {i}', 'description': '-', 'price': 1.0, 'stock': 10}
+            for i in range(Product.query.count() + 1, PRODUCTS + 1)
+        ])
+        db.session.commit()
+
+    next_id = (db.session.scalar(select(func.max(Order.id))) or 0) + 1
+    existing = db.session.scalar(select(func.count(OrderItem.id)))
+    if existing < ORDER_LINES:
+        start = time.perf_counter()
+        next_id = generate(ORDER_LINES - existing, next_id)
+        print(f'generated {ORDER_LINES - existing} order lines in {time.perf_counter() - start:.1f}s')
+
+    start = time.perf_counter()
+    orders = rebuild_recommendations()
+    print(f'full rebuild: {orders} orders, '
+          f'{db.session.scalar(select(func.count()).select_from(ProductPairCount))} pairs, '
+          f'{db.session.scalar(select(func.count()).select_from(ProductRecommendation))} top-k rows '
+          f'in {time.perf_counter() - start:.1f}s')
+
+    generate(ORDER_LINES // 100, next_id)
+    start = time.perf_counter()
+    orders = refresh_recommendations()
+    print(f'incremental refresh: {orders} orders in {time.perf_counter() - start:.2f}s')
+
+    start = time.perf_counter()
+    for product_id in range(1, 1001):
+        Product.query.join(
+            ProductRecommendation, ProductRecommendation.related_id == Product.id
+        ).filter(ProductRecommendation.product_id == product_id).order_by(ProductRecommendation.rank).all()
+    print(f'product_detail lookup: {(time.perf_counter() - start):.3f} ms avg')
@@ -0,0 +1,271 @@
+import csv
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from xml.sax.saxutils import escape
+
+from flask import current_app, url_for
+from sqlalchemy import func, select, case
+
+from models import db, Product, StockReservation
+
+FEED_COLUMNS = ['id', 'title', 'description', 'link', 'image_link', 'price', 'availability', 'condition']
+SITEMAP_MAX_URLS = 50000
+FLUSH_SIZE = 64 * 1024
+
+# Price bands shown as facets, as [low, high) in USD; None is unbounded.
+PRICE_BANDS = [(0, 10), (10, 25), (25, 50), (50, 100), (100, None)]
+SORT_OPTIONS = {
+    'default': (Product.id,),
+    'newest': (Product.created_at.desc(), Product.id.desc()),
+    'price_asc': (Product.price, Product.id),
+    'price_desc': (Product.price.desc(), Product.id.desc()),
+}
+
+_facet_cache = {'version': None, 'counts': None}
+_facet_lock = threading.Lock()
+
+
+def catalog_version():
+    """Cheap fingerprint of the products table.
+
+    Inserts and deletes change the count or the highest id, edits and stock
+    changes bump ``updated_at`` through its ``onupdate`` default.
+    """
+    # Separate subqueries so max() can be answered from the indexes instead
+    # of a scan shared with count().
+    count, max_id, last_update = db.session.execute(select(
+        select(func.count()).select_from(Product).scalar_subquery(),
+        select(func.max(Product.id)).scalar_subquery(),
+        select(func.max(Product.updated_at)).scalar_subquery(),
+    )).one()
+    last_update = last_update.isoformat() if last_update else ''
+    return hashlib.sha1(f'{count}:{max_id}:{last_update}'.encode()).hexdigest()[:16]
+
+
+def reservation_version():
+    """Fingerprint of the live stock holds.
+
+    Holds change ``Product.available`` without touching ``updated_at``, so
+    anything cached on availability keys on this as well. The table only
+    holds carts in checkout, so the aggregate is cheap.
+    """
+    count, units, checksum = db.session.execute(select(
+        func.count(),
+        func.coalesce(func.sum(StockReservation.quantity), 0),
+        func.coalesce(func.sum(StockReservation.product_id * StockReservation.quantity), 0),
+    )).one()
+    return f'{count}:{units}:{checksum}'
+
+
+def filtered_product_ids(min_price=None, max_price=None, in_stock=False, sort='default', band=None):
+    """Product ids matching the storefront filters, in display order.
+
+    ``min_price``/``max_price`` are the inclusive range typed by the customer;
+    ``band`` is an index into ``PRICE_BANDS`` as linked from the facets.
+    Only indexed columns are touched, so filtering, sorting and paging run on
+    the covering indexes and full rows are loaded just for the page shown.
+    """
+    stmt = select(Product.id)
+    if min_price is not None:
+        stmt = stmt.where(Product.price >= min_price)
+    if max_price is not None:
+        stmt = stmt.where(Product.price <= max_price)
+    if band is not None:
+        low, high = PRICE_BANDS[band]
+        stmt = stmt.where(Product.price >= low)
+        if high is not None:
+            stmt = stmt.where(Product.price < high)
+    if in_stock:
+        stmt = stmt.where(Product.stock - Product.reserved > 0)
+    return stmt.order_by(*SORT_OPTIONS.get(sort, SORT_OPTIONS['default']))
+
+
+def products_by_ids(ids):
+    products = {product.id: product for product in Product.query.filter(Product.id.in_(ids))}
+    return [products[product_id] for product_id in ids if product_id in products]
+
+
+def facet_counts():
+    """Product counts per price band, split by available-to-sell, cached per
+    catalog and reservation version.
+
+    Returns ``{'bands': [(low, high, total, in_stock), ...], 'total': n, 'in_stock': n}``.
+    """
+    version = f'{catalog_version()}:{reservation_version()}'
+    with _facet_lock:
+        if _facet_cache['version'] == version:
+            return _facet_cache['counts']
+
+    band = case(
+        *[(Product.price < high, index) for index, (_, high) in enumerate(PRICE_BANDS) if high is not None],
+        else_=len(PRICE_BANDS) - 1,
+    )
+    available = case((Product.stock - Product.reserved > 0, 1), else_=0)
+    rows = db.session.execute(
+        select(band, available, func.count(Product.id)).group_by(band, available)
+    ).all()
+
+    totals = [[0, 0] for _ in PRICE_BANDS]
+    for index, is_available, count in rows:
+        totals[index][0] += count
+        if is_available:
+            totals[index][1] += count
+    counts = {
+        'bands': [(low, high, total, in_stock) for (low, high), (total, in_stock) in zip(PRICE_BANDS, totals)],
+        'total': sum(total for total, _ in totals),
+        'in_stock': sum(in_stock for _, in_stock in totals),
+    }
+    with _facet_lock:
+        _facet_cache['version'] = version
+        _facet_cache['counts'] = counts
+    return counts
+
+
+def iter_products(*columns, start=0, limit=None, batch_size=1000):
+    """Stream product rows in id order through a server-side cursor."""
+    stmt = select(*columns).order_by(Product.id).offset(start)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return db.session.execute(stmt.execution_options(yield_per=batch_size))
+
+
+def buffered(pieces):
+    buffer = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= FLUSH_SIZE:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def absolute_url(endpoint, **values):
+    """External URL on the canonical ``SITE_URL``, never the request's Host header."""
+    site_url = current_app.config['SITE_URL']
+    if not site_url:
+        return url_for(endpoint, _external=True, **values)
+    return site_url.rstrip('/') + url_for(endpoint, **values)
+
+
+def _feed_rows():
+    # Feeds are cached per catalog_version(), which temporary holds do not
+    # change, so availability follows stock alone.
+    rows = iter_products(Product.id, Product.name, Product.description, Product.price,
+                         Product.stock, Product.image_filename)
+    for product_id, name, description, price, stock, image_filename in rows:
+        yield {
+            'id': str(product_id),
+            'title': name,
+            'description': description,
+            'link': absolute_url('product_detail', product_id=product_id),
+            'image_link': absolute_url('static', filename='uploads/' + image_filename) if image_filename else '',
+            'price': f'{price:.2f} USD',
+            'availability': 'in_stock' if stock > 0 else 'out_of_stock',
+            'condition': 'new',
+        }
+
+
+def generate_feed_xml():
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield '<rss version="2.0" xmlns:g="http://base.google.com/ns/1.0">\n<channel>\n'
+    yield '<title>GreenMarket Ecuador</title>\n'
+    yield f'<link>{escape(absolute_url("index"))}</link>\n'
+    yield '<description>Productos automotrices ecológicos</description>\n'
+    for row in _feed_rows():
+        yield '<item>'
+        yield f'<g:id>{row["id"]}</g:id>'
+        yield f'<title>{escape(row["title"])}</title>'
+        yield f'<description>{escape(row["description"])}</description>'
+        yield f'<link>{escape(row["link"])}</link>'
+        if row['image_link']:
+            yield f'<g:image_link>{escape(row["image_link"])}</g:image_link>'
+        yield f'<g:price>{row["price"]}</g:price>'
+        yield f'<g:availability>{row["availability"]}</g:availability>'
+        yield f'<g:condition>{row["condition"]}</g:condition>'
+        yield '</item>\n'
+    yield '</channel>\n</rss>\n'
+
+
+def generate_feed_csv():
+    line = io.StringIO()
+    writer = csv.writer(line)
+    writer.writerow(FEED_COLUMNS)
+    for row in _feed_rows():
+        writer.writerow([row[column] for column in FEED_COLUMNS])
+        yield line.getvalue()
+        line.seek(0)
+        line.truncate()
+    yield line.getvalue()
+
+
+def sitemap_page_count():
+    products = db.session.scalar(select(func.count(Product.id)))
+    return max(1, -(-(products + 2) // SITEMAP_MAX_URLS))
+
+
+def generate_sitemap(page=None):
+    """The sitemap itself, or a sitemap index once the catalog outgrows one file."""
+    pages = sitemap_page_count()
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    if page is None and pages > 1:
+        yield '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+        for number in range(1, pages + 1):
+            yield f'<sitemap><loc>{escape(absolute_url("sitemap_page", page=number))}</loc></sitemap>\n'
+        yield '</sitemapindex>\n'
+        return
+
+    page = page or 1
+    yield '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    start = (page - 1) * SITEMAP_MAX_URLS
+    if page == 1:
+        yield f'<url><loc>{escape(absolute_url("index"))}</loc></url>\n'
+        yield f'<url><loc>{escape(absolute_url("contact"))}</loc></url>\n'
+        limit = SITEMAP_MAX_URLS - 2
+    else:
+        start -= 2
+        limit = SITEMAP_MAX_URLS
+    for product_id, updated_at in iter_products(Product.id, Product.updated_at, start=start, limit=limit):
+        lastmod = f'<lastmod>{updated_at.date().isoformat()}</lastmod>' if updated_at else ''
+        yield f'<url><loc>{escape(absolute_url("product_detail", product_id=product_id))}</loc>{lastmod}</url>\n'
+    yield '</urlset>\n'
+
+
+def cached_stream(folder, name, version, generate):
+    """Return ``(path, None)`` for a cached file or ``(None, chunks)`` to stream.
+
+    When the file for ``version`` is missing the generated output is streamed
+    to the client and written to a temporary file at the same time; it only
+    replaces the cache once complete, so an aborted download leaves nothing
+    behind and concurrent workers never read a partial file.
+    """
+    path = os.path.join(folder, f'{name}-{version}')
+    if os.path.exists(path):
+        return path, None
+
+    def chunks():
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=f'.{name}-')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                for chunk in buffered(generate()):
+                    f.write(chunk)
+                    yield chunk
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        for entry in os.listdir(folder):
+            if entry.startswith(f'{name}-') and entry != os.path.basename(path):
+                try:
+                    os.remove(os.path.join(folder, entry))
+                except OSError:
+                    pass
+
+    return None, chunks()
@@ -0,0 +1,77 @@
+import csv
+import io
+import json
+
+from sqlalchemy import select
+
+from catalog import buffered
+from models import db, Order, OrderItem, Product, User
+
+EXPORT_COLUMNS = [
+    'order_id', 'created_at', 'status', 'payment_method', 'payment_id', 'total_amount',
+    'user_id', 'user_email', 'item_id', 'product_id', 'product_name', 'quantity',
+    'unit_price', 'subtotal',
+]
+
+
+def order_lines_query(date_from=None, date_to=None, status=None):
+    """One row per order line, orders without lines included, in a single query.
+
+    The date range is applied to both tables so that on PostgreSQL only the
+    matching monthly partitions of orders and order_items are scanned.
+    """
+    lines = OrderItem.order_id == Order.id
+    if date_from is not None:
+        lines &= OrderItem.created_at >= date_from
+    if date_to is not None:
+        lines &= OrderItem.created_at < date_to
+    stmt = (
+        select(
+            Order.id, Order.created_at, Order.status, Order.payment_method, Order.payment_id,
+            Order.total_amount, Order.user_id, User.email, OrderItem.id, OrderItem.product_id,
+            Product.name, OrderItem.quantity, OrderItem.unit_price, OrderItem.subtotal,
+        )
+        .outerjoin(User, User.id == Order.user_id)
+        .outerjoin(OrderItem, lines)
+        .outerjoin(Product, Product.id == OrderItem.product_id)
+        .order_by(Order.id, OrderItem.id)
+    )
+    if date_from is not None:
+        stmt = stmt.where(Order.created_at >= date_from)
+    if date_to is not None:
+        stmt = stmt.where(Order.created_at < date_to)
+    if status:
+        stmt = stmt.where(Order.status == status)
+    return stmt
+
+
+def _rows(stmt, batch_size):
+    for row in db.session.execute(stmt.execution_options(yield_per=batch_size)):
+        yield dict(zip(EXPORT_COLUMNS, row))
+
+
+def generate_orders_csv(stmt, batch_size=2000):
+    def lines():
+        line = io.StringIO()
+        writer = csv.writer(line)
+        writer.writerow(EXPORT_COLUMNS)
+        for row in _rows(stmt, batch_size):
+            if row['created_at'] is not None:
+                row['created_at'] = row['created_at'].isoformat()
+            writer.writerow([row[column] for column in EXPORT_COLUMNS])
+            yield line.getvalue()
+            line.seek(0)
+            line.truncate()
+        yield line.getvalue()
+
+    return buffered(lines())
+
+
+def generate_orders_jsonl(stmt, batch_size=2000):
+    def lines():
+        for row in _rows(stmt, batch_size):
+            if row['created_at'] is not None:
+                row['created_at'] = row['created_at'].isoformat()
+            yield json.dumps(row, ensure_ascii=False) + '\n'
+
+    return buffered(lines())
@@ -0,0 +1,45 @@
+import gc
+import multiprocessing
+import os
+
+# Load main.py once in the master so imports, the Flask app and the compiled
+# Jinja templates are shared copy-on-write by every worker.
+preload_app = True
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+keepalive = 5
+max_requests = 2000
+max_requests_jitter = 200
+
+
+def when_ready(server):
+    from main import app
+
+    # Compile every template before forking instead of once per worker.
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+    # Move everything allocated so far out of the collector's reach so the
+    # first collection in a worker does not touch (and copy) shared pages.
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from main import app, limiter
+    from models import db
+
+    # main.py talked to the database while loading in the master. Drop the
+    # inherited pool without closing the sockets the master still owns, so
+    # each worker opens its own connections.
+    with app.app_context():
+        db.engine.dispose(close=False)
+    engine = getattr(limiter.backend, 'engine', None)
+    if engine is not None:
+        engine.dispose(close=False)
@@ -2,18 +2,32 @@ import os
 from dotenv import load_dotenv
 load_dotenv()
 
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, Response, send_file, stream_with_context, abort
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
-from models import db, Product, AdminUser, SiteConfig, User, Order, OrderItem, PaymentMethod
+from werkzeug.middleware.proxy_fix import ProxyFix
+from models import db, Product, AdminUser, SiteConfig, User, Order, OrderItem, PaymentMethod, ProductRecommendation, StockReservation
 from functools import wraps
 from PIL import Image
 import stripe
 import paypalrestsdk
 from flask_mail import Mail, Message
+from ratelimit import RateLimiter
+from recommendations import refresh_recommendations, rebuild_recommendations
+from catalog import catalog_version, cached_stream, buffered, sitemap_page_count, generate_sitemap, generate_feed_xml, generate_feed_csv, filtered_product_ids, products_by_ids, facet_counts, SORT_OPTIONS, PRICE_BANDS
+from exports import order_lines_query, generate_orders_csv, generate_orders_jsonl
+from reservations import ReservationSweeper, hold_cart, extend_hold, complete_sale, release_hold
+from partitioning import prepare_order_tables, convert_to_partitioned, ensure_partitions, archive_orders
+import uuid
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+from datetime import datetime, timedelta
+import click
+import time
 
 
 app = Flask(__name__)
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.environ.get('PROXY_FIX_X_FOR', 1)))
 
 if not os.environ.get("SESSION_SECRET"):
     raise ValueError("SESSION_SECRET environment variable must be set")
@@ -38,6 +52,20 @@ app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER', 'norep
 
 mail = Mail(app)
 
+app.config['RATELIMIT_ENABLED'] = os.environ.get('RATELIMIT_ENABLED', 'True') == 'True'
+app.config['RATELIMIT_STORAGE_URL'] = os.environ.get('RATELIMIT_STORAGE_URL', 'memory://')
+app.config['RATELIMIT_MAX_QUEUE_WAIT'] = float(os.environ.get('RATELIMIT_MAX_QUEUE_WAIT', 5))
+app.config['RATELIMIT_MAX_GATEWAY'] = int(os.environ.get('RATELIMIT_MAX_GATEWAY', 2))
+app.config['RATELIMIT_RULES'] = {
+    'contact': {'per_ip': (3, 300), 'per_route': (30, 60), 'gateway': True},
+    'create_stripe_checkout': {'per_ip': (5, 60), 'per_route': (60, 60), 'gateway': True},
+    'create_paypal_order': {'per_ip': (5, 60), 'per_route': (60, 60), 'gateway': True},
+    'execute_paypal_payment': {'per_ip': (5, 60), 'gateway': True, 'methods': ('GET',)},
+    'add_to_cart': {'per_ip': (30, 60)},
+    'update_cart': {'per_ip': (60, 60)},
+    'admin_login': {'per_ip': (10, 300)},
+}
+
 @app.after_request
 def add_header(response):
     response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0, max-age=0'
@@ -50,10 +78,15 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
 }
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
+app.config['FEED_CACHE_FOLDER'] = os.path.join(app.instance_path, 'feeds')
+# Canonical base URL for sitemap and feed links, e.g. https://www.example.com.
+app.config['SITE_URL'] = os.environ.get('SITE_URL') or os.environ.get('RENDER_EXTERNAL_URL')
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 
 db.init_app(app)
+limiter = RateLimiter(app)
+sweeper = ReservationSweeper(app)
 
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs('static/css', exist_ok=True)
@@ -88,43 +121,116 @@ def get_cart_count():
     cart = get_cart()
     return sum(item['quantity'] for item in cart.values())
 
+def get_reservation_token():
+    if 'reservation_token' not in session:
+        session['reservation_token'] = uuid.uuid4().hex
+    return session['reservation_token']
+
+def release_cart_hold():
+    # The cart changed, so the stock held for it at checkout no longer applies.
+    if session.pop('reservation_held', None):
+        release_hold(session['reservation_token'])
+        db.session.commit()
+
+def wants_json():
+    return request.accept_mimetypes.best == 'application/json'
+
+def cart_response(product_id, message, category, fallback_url, status=200):
+    # fetch() callers get the changed line, totals and badge count instead of
+    # a redirect to the fully re-rendered cart; plain forms keep the redirect.
+    if wants_json():
+        item = get_cart().get(str(product_id))
+        quantity = item['quantity'] if item else 0
+        return jsonify({
+            'ok': category == 'success',
+            'message': message,
+            'product_id': product_id,
+            'quantity': quantity,
+            'subtotal': item['price'] * quantity if item else 0,
+            'total': get_cart_total(),
+            'cart_count': get_cart_count()
+        }), status
+    flash(message, category)
+    return redirect(fallback_url)
+
+def complete_cart_sale():
+    session.pop('reservation_held', None)
+    complete_sale(get_reservation_token(), {int(product_id): item['quantity'] for product_id, item in get_cart().items()})
+    db.session.commit()
+    session['cart'] = {}
+
+def cart_matches_hold(cart, held):
+    return bool(cart) and all(held.get(int(product_id)) == item['quantity'] for product_id, item in cart.items())
+
+PRODUCTS_PER_PAGE = 24
+# Stripe rejects expires_at less than 30 minutes after it creates the
+# session, which happens after we compute the deadline; keep a margin.
+STRIPE_SESSION_TTL = timedelta(minutes=31)
+
 @app.route('/')
 def index():
-    products = Product.query.all()
-    return render_template('index.html', products=products, cart_count=get_cart_count())
+    min_price = request.args.get('min_price', type=float)
+    max_price = request.args.get('max_price', type=float)
+    in_stock = request.args.get('in_stock') == '1'
+    band = request.args.get('band', type=int)
+    if band is not None and not 0 <= band < len(PRICE_BANDS):
+        band = None
+    sort = request.args.get('sort', 'default')
+    if sort not in SORT_OPTIONS:
+        sort = 'default'
+    
+    pagination = db.paginate(
+        filtered_product_ids(min_price, max_price, in_stock, sort, band),
+        page=request.args.get('page', 1, type=int),
+        per_page=PRODUCTS_PER_PAGE,
+        error_out=False
+    )
+    filters = {
+        'min_price': min_price,
+        'max_price': max_price,
+        'in_stock': in_stock,
+        'band': band,
+        'sort': sort
+    }
+    return render_template('index.html', products=products_by_ids(pagination.items), pagination=pagination,
+                           filters=filters, facets=facet_counts(), cart_count=get_cart_count())
 
 @app.route('/product/<int:product_id>')
 def product_detail(product_id):
     product = Product.query.get_or_404(product_id)
+    related_products = Product.query.join(
+        ProductRecommendation, ProductRecommendation.related_id == Product.id
+    ).filter(
+        ProductRecommendation.product_id == product_id
+    ).order_by(ProductRecommendation.rank).all()
     cart_count = get_cart_count()
-    return render_template('product_detail.html', product=product, cart_count=cart_count)
+    return render_template('product_detail.html', product=product, related_products=related_products, cart_count=cart_count)
 
 @app.route('/cart/add/<int:product_id>', methods=['POST'])
 def add_to_cart(product_id):
+    release_cart_hold()
     product = Product.query.get_or_404(product_id)
     
+    product_url = url_for('product_detail', product_id=product_id)
+    
     try:
         quantity = int(request.form.get('quantity', 1))
     except (ValueError, TypeError):
-        flash('Cantidad inválida', 'error')
-        return redirect(url_for('product_detail', product_id=product_id))
+        return cart_response(product_id, 'Cantidad inválida', 'error', product_url, 400)
     
     if quantity <= 0:
-        flash('La cantidad debe ser mayor a cero', 'error')
-        return redirect(url_for('product_detail', product_id=product_id))
+        return cart_response(product_id, 'La cantidad debe ser mayor a cero', 'error', product_url, 400)
     
-    if product.stock < quantity:
-        flash(f'Solo hay {product.stock} unidades disponibles', 'error')
-        return redirect(url_for('product_detail', product_id=product_id))
+    if product.available < quantity:
+        return cart_response(product_id, f'Solo hay {max(product.available, 0)} unidades disponibles', 'error', product_url, 409)
     
     cart = get_cart()
     product_id_str = str(product_id)
     
     if product_id_str in cart:
         new_quantity = cart[product_id_str]['quantity'] + quantity
-        if new_quantity > product.stock:
-            flash(f'Solo hay {product.stock} unidades disponibles', 'error')
-            return redirect(url_for('product_detail', product_id=product_id))
+        if new_quantity > product.available:
+            return cart_response(product_id, f'Solo hay {max(product.available, 0)} unidades disponibles', 'error', product_url, 409)
         cart[product_id_str]['quantity'] = new_quantity
     else:
         cart[product_id_str] = {
@@ -135,8 +241,7 @@ def add_to_cart(product_id):
         }
     
     session['cart'] = cart
-    flash(f'{product.name} agregado al carrito', 'success')
-    return redirect(url_for('view_cart'))
+    return cart_response(product_id, f'{product.name} agregado al carrito', 'success', url_for('view_cart'))
 
 @app.route('/cart')
 def view_cart():
@@ -161,45 +266,51 @@ def view_cart():
 
 @app.route('/cart/update/<int:product_id>', methods=['POST'])
 def update_cart(product_id):
+    release_cart_hold()
     product = Product.query.get_or_404(product_id)
     
     try:
         quantity = int(request.form.get('quantity', 1))
     except (ValueError, TypeError):
-        flash('Cantidad inválida', 'error')
-        return redirect(url_for('view_cart'))
+        return cart_response(product_id, 'Cantidad inválida', 'error', url_for('view_cart'), 400)
     
     cart = get_cart()
     product_id_str = str(product_id)
+    status = 200
     
     if quantity <= 0:
         if product_id_str in cart:
             del cart[product_id_str]
-        flash('Producto eliminado del carrito', 'success')
-    elif quantity > product.stock:
-        flash(f'Solo hay {product.stock} unidades disponibles', 'error')
+        message, category = 'Producto eliminado del carrito', 'success'
+    elif quantity > product.available:
+        message, category = f'Solo hay {max(product.available, 0)} unidades disponibles', 'error'
+        status = 409
     else:
         if product_id_str in cart:
             cart[product_id_str]['quantity'] = quantity
-        flash('Carrito actualizado', 'success')
+        message, category = 'Carrito actualizado', 'success'
     
     session['cart'] = cart
-    return redirect(url_for('view_cart'))
+    return cart_response(product_id, message, category, url_for('view_cart'), status)
 
 @app.route('/cart/remove/<int:product_id>', methods=['POST'])
 def remove_from_cart(product_id):
+    release_cart_hold()
     cart = get_cart()
     product_id_str = str(product_id)
     
     if product_id_str in cart:
         del cart[product_id_str]
         session['cart'] = cart
-        flash('Producto eliminado del carrito', 'success')
+        return cart_response(product_id, 'Producto eliminado del carrito', 'success', url_for('view_cart'))
     
+    if wants_json():
+        return cart_response(product_id, 'El producto no está en el carrito', 'success', url_for('view_cart'))
     return redirect(url_for('view_cart'))
 
 @app.route('/cart/clear', methods=['POST'])
 def clear_cart():
+    release_cart_hold()
     session['cart'] = {}
     flash('Carrito vaciado', 'success')
     return redirect(url_for('index'))
@@ -278,16 +389,36 @@ def checkout():
         flash('Tu carrito está vacío', 'error')
         return redirect(url_for('index'))
     
+    products = {product.id: product for product in Product.query.filter(Product.id.in_([int(product_id) for product_id in cart]))}
+    # Products deleted since they were added can never be held or paid for.
+    missing = [product_id for product_id in cart if int(product_id) not in products]
+    if missing:
+        for product_id in missing:
+            del cart[product_id]
+        session.modified = True
+        flash('Algunos productos de tu carrito ya no están disponibles y fueron retirados', 'error')
+        if not cart:
+            return redirect(url_for('index'))
+    
+    held, shortfalls = hold_cart(
+        get_reservation_token(),
+        {product_id: cart[str(product_id)]['quantity'] for product_id in products},
+        sweeper.ttl
+    )
+    if not held:
+        for product in shortfalls:
+            flash(f'{product.name}: Solo hay {max(product.available, 0)} unidades disponibles', 'error')
+        if not shortfalls:
+            flash('No pudimos reservar tu pedido, por favor intenta de nuevo.', 'error')
+        return redirect(url_for('view_cart'))
+    session['reservation_held'] = True
+    
     cart_items = []
     total = 0
     
     for product_id, item in cart.items():
-        product = Product.query.get(int(product_id))
+        product = products.get(int(product_id))
         if product:
-            if product.stock < item['quantity']:
-                flash(f'{product.name}: Solo hay {product.stock} unidades disponibles', 'error')
-                return redirect(url_for('view_cart'))
-            
             item_total = item['price'] * item['quantity']
             cart_items.append({
                 'product_id': product_id,
@@ -299,7 +430,8 @@ def checkout():
             total += item_total
     
     payment_methods = PaymentMethod.query.filter_by(enabled=True).order_by(PaymentMethod.display_order).all()
-    return render_template('checkout.html', cart_items=cart_items, total=total, payment_methods=payment_methods, cart_count=get_cart_count())
+    return render_template('checkout.html', cart_items=cart_items, total=total, payment_methods=payment_methods,
+                           reservation_minutes=app.config['RESERVATION_TTL_MINUTES'], cart_count=get_cart_count())
 
 @app.route('/create-stripe-checkout', methods=['POST'])
 def create_stripe_checkout():
@@ -313,10 +445,21 @@ def create_stripe_checkout():
             flash('Tu carrito está vacío', 'error')
             return redirect(url_for('index'))
         
+        # Stripe keeps a Checkout Session open for at least 30 minutes, so the
+        # hold is stretched to the session's deadline. The deadline is taken
+        # first so the hold never ends before the session does.
+        hold_ttl = max(sweeper.ttl, STRIPE_SESSION_TTL)
+        expires_at = int(time.time() + hold_ttl.total_seconds())
+        held = extend_hold(get_reservation_token(), hold_ttl)
+        if not cart_matches_hold(cart, held):
+            flash('Tu reserva de productos expiró. Por favor confirma tu compra nuevamente.', 'error')
+            return redirect(url_for('checkout'))
+        products = {product.id: product for product in Product.query.filter(Product.id.in_(held))}
+        
         line_items = []
         for product_id, item in cart.items():
-            product = Product.query.get(int(product_id))
-            if product and product.stock >= item['quantity']:
+            product = products.get(int(product_id))
+            if product:
                 line_items.append({
                     'price_data': {
                         'currency': 'usd',
@@ -339,9 +482,11 @@ def create_stripe_checkout():
             payment_method_types=['card'],
             line_items=line_items,
             mode='payment',
-            success_url=domain_url + url_for('payment_success'),
+            success_url=domain_url + url_for('payment_success') + '?session_id={CHECKOUT_SESSION_ID}',
             cancel_url=domain_url + url_for('payment_cancel'),
+            expires_at=expires_at,
         )
+        session['stripe_session_id'] = checkout_session.id
         
         return redirect(checkout_session.url, code=303)
     except Exception as e:
@@ -360,12 +505,18 @@ def create_paypal_order():
             flash('Tu carrito está vacío', 'error')
             return redirect(url_for('index'))
         
+        held = extend_hold(get_reservation_token(), sweeper.ttl)
+        if not cart_matches_hold(cart, held):
+            flash('Tu reserva de productos expiró. Por favor confirma tu compra nuevamente.', 'error')
+            return redirect(url_for('checkout'))
+        products = {product.id: product for product in Product.query.filter(Product.id.in_(held))}
+        
         items = []
         total = 0
         
         for product_id, item in cart.items():
-            product = Product.query.get(int(product_id))
-            if product and product.stock >= item['quantity']:
+            product = products.get(int(product_id))
+            if product:
                 item_total = item['price'] * item['quantity']
                 items.append({
                     "name": product.name,
@@ -424,14 +575,7 @@ def execute_paypal_payment():
         payment = paypalrestsdk.Payment.find(payment_id)
         
         if payment.execute({"payer_id": payer_id}):
-            cart = get_cart()
-            for product_id, item in cart.items():
-                product = Product.query.get(int(product_id))
-                if product and product.stock >= item['quantity']:
-                    product.stock -= item['quantity']
-            
-            db.session.commit()
-            session['cart'] = {}
+            complete_cart_sale()
             flash('¡Pago completado exitosamente con PayPal!', 'success')
             return redirect(url_for('payment_success'))
         else:
@@ -443,12 +587,50 @@ def execute_paypal_payment():
 
 @app.route('/payment/success')
 def payment_success():
+    stripe_session_id = request.args.get('session_id')
+    if stripe_session_id and stripe_session_id == session.get('stripe_session_id'):
+        try:
+            checkout_session = stripe.checkout.Session.retrieve(stripe_session_id)
+            if checkout_session.payment_status == 'paid':
+                session.pop('stripe_session_id', None)
+                complete_cart_sale()
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error al confirmar el pago con Stripe: {str(e)}', 'error')
     return render_template('payment_success.html')
 
 @app.route('/payment/cancel')
 def payment_cancel():
+    release_cart_hold()
     return render_template('payment_cancel.html')
 
+def catalog_file_response(name, generate, mimetype):
+    if not app.config['SITE_URL']:
+        # Links would follow the client's Host header; never cache those.
+        return Response(stream_with_context(buffered(generate())), mimetype=mimetype)
+    path, chunks = cached_stream(app.config['FEED_CACHE_FOLDER'], name, catalog_version(), generate)
+    if path:
+        return send_file(os.path.abspath(path), mimetype=mimetype)
+    return Response(stream_with_context(chunks), mimetype=mimetype)
+
+@app.route('/sitemap.xml')
+def sitemap():
+    return catalog_file_response('sitemap', generate_sitemap, 'application/xml')
+
+@app.route('/sitemap-<int:page>.xml')
+def sitemap_page(page):
+    if page < 1 or page > sitemap_page_count():
+        abort(404)
+    return catalog_file_response(f'sitemap{page}', lambda: generate_sitemap(page), 'application/xml')
+
+@app.route('/feeds/products.xml')
+def product_feed_xml():
+    return catalog_file_response('products-xml', generate_feed_xml, 'application/xml')
+
+@app.route('/feeds/products.csv')
+def product_feed_csv():
+    return catalog_file_response('products-csv', generate_feed_csv, 'text/csv')
+
 @app.route('/admin/login', methods=['GET', 'POST'])
 def admin_login():
     if request.method == 'POST':
@@ -621,6 +803,7 @@ def admin_delete_product(product_id):
         if os.path.exists(image_path):
             os.remove(image_path)
     
+    StockReservation.query.filter_by(product_id=product_id).delete()
     db.session.delete(product)
     db.session.commit()
     
@@ -700,6 +883,39 @@ def admin_payments():
     payments = PaymentMethod.query.order_by(PaymentMethod.display_order).all()
     return render_template('admin_payments.html', payments=payments)
 
+@app.route('/admin/orders/export')
+@login_required
+def admin_orders_export():
+    statuses = [status for status, in db.session.query(Order.status).distinct().order_by(Order.status) if status]
+    return render_template('admin_orders_export.html', statuses=statuses)
+
+@app.route('/admin/orders/export/download')
+@login_required
+def admin_orders_export_download():
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'jsonl'):
+        flash('Formato de exportación inválido', 'error')
+        return redirect(url_for('admin_orders_export'))
+    
+    try:
+        date_from = request.args.get('date_from', '').strip()
+        date_to = request.args.get('date_to', '').strip()
+        date_from = datetime.strptime(date_from, '%Y-%m-%d') if date_from else None
+        date_to = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1) if date_to else None
+    except ValueError:
+        flash('Las fechas deben tener el formato AAAA-MM-DD', 'error')
+        return redirect(url_for('admin_orders_export'))
+    
+    stmt = order_lines_query(date_from, date_to, request.args.get('status', '').strip() or None)
+    if export_format == 'csv':
+        chunks, mimetype = generate_orders_csv(stmt), 'text/csv'
+    else:
+        chunks, mimetype = generate_orders_jsonl(stmt), 'application/x-ndjson'
+    
+    filename = f"ordenes-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.{export_format}"
+    return Response(stream_with_context(chunks), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
 @app.route('/admin/change-password', methods=['GET', 'POST'])
 @login_required
 def admin_change_password():
@@ -760,8 +976,87 @@ def init_defaults():
             db.session.commit()
             print("Payment methods initialized")
 
+@app.cli.command('refresh-recommendations')
+@click.option('--full', is_flag=True, help='Recalcular desde todo el historial de órdenes.')
+def refresh_recommendations_command(full):
+    """Actualiza los productos "comprados juntos" con las órdenes nuevas."""
+    processed = rebuild_recommendations() if full else refresh_recommendations()
+    print(f"Recommendations updated from {processed} orders")
+
+# Indexes that models used to declare; they are replaced by newer ones and
+# only slow down writes.
+OBSOLETE_INDEXES = {
+    'products': ['ix_products_price_catalog', 'ix_products_created_at_catalog'],
+}
+
+# Values for rows left NULL in columns added to existing tables; once
+# filled, ensure_schema() makes NOT NULL columns NOT NULL in the database.
+COLUMN_BACKFILLS = {
+    ('order_items', 'created_at'): (
+        'UPDATE order_items SET created_at = COALESCE('
+        '(SELECT orders.created_at FROM orders WHERE orders.id = order_items.order_id), CURRENT_TIMESTAMP) '
+        'WHERE created_at IS NULL'
+    ),
+}
+
+def ensure_schema():
+    # create_all() skips tables that already exist, so columns and indexes
+    # added to the models later are created here.
+    inspector = inspect(db.engine)
+    preparer = db.engine.dialect.identifier_preparer
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            existing = {column['name']: column for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                backfill = COLUMN_BACKFILLS.get((table.name, column.name))
+                if column.name not in existing:
+                    if backfill:
+                        # Added nullable and tightened below, after the backfill.
+                        ddl = f'{preparer.format_column(column)} {column.type.compile(dialect=db.engine.dialect)}'
+                    else:
+                        ddl = CreateColumn(column).compile(dialect=db.engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN {ddl}'))
+                elif not backfill or not existing[column.name]['nullable']:
+                    continue
+                if backfill:
+                    conn.execute(text(backfill))
+                    # SQLite cannot change a column's nullability in place.
+                    if not column.nullable and db.engine.dialect.name != 'sqlite':
+                        conn.execute(text(
+                            f'ALTER TABLE {preparer.format_table(table)} '
+                            f'ALTER COLUMN {preparer.format_column(column)} SET NOT NULL'
+                        ))
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    with db.engine.begin() as conn:
+        for table_name, names in OBSOLETE_INDEXES.items():
+            existing = {index['name'] for index in inspector.get_indexes(table_name)}
+            for name in names:
+                if name in existing:
+                    conn.execute(text(f'DROP INDEX {preparer.quote(name)}'))
+
+@app.cli.command('maintain-order-partitions')
+@click.option('--months-ahead', default=3, show_default=True, help='Meses futuros con partición creada.')
+@click.option('--keep-months', default=24, show_default=True, help='Meses completos que se mantienen en las tablas activas.')
+@click.option('--archive-dir', default=None, help='Escribir lo archivado como CSV comprimido en este directorio en lugar de las tablas *_archive.')
+@click.option('--convert', is_flag=True, help='Convertir tablas orders/order_items existentes a particionadas (PostgreSQL).')
+def maintain_order_partitions_command(months_ahead, keep_months, archive_dir, convert):
+    """Crea particiones mensuales futuras y archiva las órdenes antiguas."""
+    if convert and convert_to_partitioned(months_ahead):
+        print("orders and order_items converted to partitioned tables")
+        ensure_schema()
+    if db.engine.dialect.name == 'postgresql':
+        with db.engine.begin() as conn:
+            for name in ensure_partitions(conn, months_ahead):
+                print(f"Created partition {name}")
+    for entry in archive_orders(keep_months, archive_dir):
+        print(f"Archived {entry}")
+
 with app.app_context():
+    prepare_order_tables()
     db.create_all()
+    ensure_schema()
     init_defaults()
 
 if __name__ == "__main__":
@@ -1,7 +1,9 @@
 import os
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import select
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.ext.hybrid import hybrid_property
 
 class Base(DeclarativeBase):
     pass
@@ -10,16 +12,26 @@ db = SQLAlchemy(model_class=Base)
 
 class Product(db.Model):
     __tablename__ = 'products'
+    __table_args__ = (
+        db.Index('ix_products_price_available', 'price', 'stock', 'reserved', 'created_at', 'id'),
+        db.Index('ix_products_created_at_available', 'created_at', 'stock', 'reserved', 'price', 'id'),
+        db.Index('ix_products_updated_at', 'updated_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, nullable=False)
     price = db.Column(db.Float, nullable=False)
     stock = db.Column(db.Integer, nullable=False, default=0)
+    reserved = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     image_filename = db.Column(db.String(300))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    @hybrid_property
+    def available(self):
+        return self.stock - self.reserved
+    
     def __repr__(self):
         return f'<Product {self.name}>'
 
@@ -68,7 +80,7 @@ class Order(db.Model):
     payment_id = db.Column(db.String(200))
     total_amount = db.Column(db.Float, nullable=False)
     status = db.Column(db.String(50), default='pending')
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
     user = db.relationship('User', backref='orders')
     
@@ -79,11 +91,15 @@ class OrderItem(db.Model):
     __tablename__ = 'order_items'
     
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False, index=True)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False, default=1)
     unit_price = db.Column(db.Float, nullable=False)
     subtotal = db.Column(db.Float, nullable=False)
+    # Copy of the order's created_at, filled in by copy_order_date; orders and
+    # order_items are partitioned by month on it in PostgreSQL (see
+    # partitioning.py) and date filters on order lines rely on it.
+    created_at = db.Column(db.DateTime, nullable=False)
     
     order = db.relationship('Order', backref='items')
     product = db.relationship('Product', backref='order_items')
@@ -91,6 +107,18 @@ class OrderItem(db.Model):
     def __repr__(self):
         return f'<OrderItem {self.id}>'
 
+@db.event.listens_for(OrderItem, 'before_insert')
+def copy_order_date(mapper, connection, target):
+    if target.created_at is not None:
+        return
+    order = target.__dict__.get('order')
+    if order is not None:
+        target.created_at = order.created_at
+    else:
+        target.created_at = connection.scalar(select(Order.created_at).where(Order.id == target.order_id))
+    if target.created_at is None:
+        target.created_at = datetime.utcnow()
+
 class PaymentMethod(db.Model):
     __tablename__ = 'payment_methods'
     
@@ -101,3 +129,37 @@ class PaymentMethod(db.Model):
     
     def __repr__(self):
         return f'<PaymentMethod {self.name}>'
+
+class ProductPairCount(db.Model):
+    __tablename__ = 'product_pair_counts'
+    
+    product_id = db.Column(db.Integer, primary_key=True)
+    related_id = db.Column(db.Integer, primary_key=True)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<ProductPairCount {self.product_id}-{self.related_id}>'
+
+class ProductRecommendation(db.Model):
+    __tablename__ = 'product_recommendations'
+    
+    product_id = db.Column(db.Integer, primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)
+    related_id = db.Column(db.Integer, nullable=False)
+    score = db.Column(db.Integer, nullable=False)
+    
+    def __repr__(self):
+        return f'<ProductRecommendation {self.product_id}#{self.rank}>'
+
+class StockReservation(db.Model):
+    __tablename__ = 'stock_reservations'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    token = db.Column(db.String(64), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<StockReservation {self.token} {self.product_id}x{self.quantity}>'
@@ -0,0 +1,299 @@
+import csv
+import gzip
+import os
+import re
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import MetaData, PrimaryKeyConstraint, inspect, text
+from sqlalchemy.schema import CreateTable
+
+from models import db, Order, OrderItem
+
+# Partitioned tables, parents first. Rows are placed by created_at; order
+# lines carry a copy of their order's date so both tables prune together.
+PARTITIONED_TABLES = [Order.__table__, OrderItem.__table__]
+PARTITION_NAME = re.compile(r'^(?P<table>\w+)_p(?P<year>\d{4})_(?P<month>\d{2})$')
+
+
+def _month_start(value):
+    return datetime(value.year, value.month, 1)
+
+
+def _add_months(value, months):
+    month = value.month - 1 + months
+    return datetime(value.year + month // 12, month % 12 + 1, 1)
+
+
+def _partition_name(table_name, month):
+    return f'{table_name}_p{month.year:04d}_{month.month:02d}'
+
+
+def _is_postgres(conn):
+    return conn.dialect.name == 'postgresql'
+
+
+def _relkind(conn, table_name):
+    return conn.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)"), {'name': table_name}
+    ).scalar()
+
+
+def _columns(table):
+    return ', '.join(f'"{column.name}"' for column in table.columns)
+
+
+def _partitioned_ddl(table):
+    """CREATE TABLE for ``table`` as a PostgreSQL range-partitioned parent.
+
+    The primary key has to include the partition key, and foreign keys into
+    ``orders`` are dropped because its id alone is no longer unique.
+    """
+    metadata = MetaData()
+    for other in db.metadata.sorted_tables:
+        if other is not table:
+            other.to_metadata(metadata)
+    copy = table.to_metadata(metadata)
+    copy.dialect_options['postgresql']['partition_by'] = 'RANGE (created_at)'
+    for constraint in list(copy.foreign_key_constraints):
+        if constraint.referred_table.name == Order.__tablename__:
+            copy.constraints.discard(constraint)
+            for column in constraint.columns:
+                column.foreign_keys.clear()
+    copy.c.created_at.nullable = False
+    copy.c.created_at.primary_key = True
+    copy.c.id.autoincrement = True
+    copy.append_constraint(PrimaryKeyConstraint(copy.c.id, copy.c.created_at))
+    return CreateTable(copy, include_foreign_key_constraints=copy.foreign_key_constraints)
+
+
+def list_partitions(conn, table_name):
+    """``{month: partition_name}`` for the monthly partitions of ``table_name``."""
+    rows = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:name)"
+    ), {'name': table_name}).scalars()
+    partitions = {}
+    for name in rows:
+        match = PARTITION_NAME.match(name)
+        if match and match['table'] == table_name:
+            partitions[datetime(int(match['year']), int(match['month']), 1)] = name
+    return partitions
+
+
+def create_partition(conn, table, month):
+    """Attach the partition for ``month``, moving any rows parked in the default partition."""
+    name = _partition_name(table.name, month)
+    low, high = month.isoformat(sep=' '), _add_months(month, 1).isoformat(sep=' ')
+    default = f'{table.name}_default'
+    conn.execute(text(f'CREATE TABLE "{name}" (LIKE "{table.name}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'))
+    conn.execute(text(
+        f'WITH moved AS (DELETE FROM "{default}" WHERE created_at >= :low AND created_at < :high RETURNING *) '
+        f'INSERT INTO "{name}" ({_columns(table)}) SELECT {_columns(table)} FROM moved'
+    ), {'low': low, 'high': high})
+    conn.execute(text(
+        f'ALTER TABLE "{table.name}" ATTACH PARTITION "{name}" FOR VALUES FROM (\'{low}\') TO (\'{high}\')'
+    ))
+    return name
+
+
+def ensure_partitions(conn, months_ahead=3, first_month=None):
+    """Create monthly partitions from ``first_month`` (default: now) to ``months_ahead``."""
+    created = []
+    current = _month_start(datetime.utcnow())
+    last = _add_months(current, months_ahead)
+    for table in PARTITIONED_TABLES:
+        existing = list_partitions(conn, table.name)
+        month = _month_start(first_month) if first_month else current
+        while month <= last:
+            if month not in existing:
+                created.append(create_partition(conn, table, month))
+            month = _add_months(month, 1)
+    return created
+
+
+def _create_partitioned_tables(conn, months_ahead):
+    for table in PARTITIONED_TABLES:
+        conn.execute(_partitioned_ddl(table))
+        conn.execute(text(f'CREATE TABLE "{table.name}_default" PARTITION OF "{table.name}" DEFAULT'))
+    ensure_partitions(conn, months_ahead)
+
+
+def prepare_order_tables(months_ahead=3):
+    """On a fresh PostgreSQL database create orders/order_items partitioned.
+
+    Runs before ``db.create_all()``, which then skips the two tables. Other
+    databases, and PostgreSQL databases that already have plain tables (see
+    ``convert_to_partitioned``), keep the regular tables.
+    """
+    with db.engine.begin() as conn:
+        if not _is_postgres(conn) or _relkind(conn, Order.__tablename__) is not None:
+            return False
+        others = [table for table in db.metadata.sorted_tables if table not in PARTITIONED_TABLES]
+        db.metadata.create_all(conn, tables=others)
+        _create_partitioned_tables(conn, months_ahead)
+    return True
+
+
+def convert_to_partitioned(months_ahead=3):
+    """Rebuild existing plain orders/order_items tables as partitioned tables.
+
+    Copies every row in one transaction, so run it during a quiet period.
+    """
+    with db.engine.begin() as conn:
+        if not _is_postgres(conn) or _relkind(conn, Order.__tablename__) != 'r':
+            return False
+
+        order_table, item_table = PARTITIONED_TABLES
+        existing_item_columns = {column['name'] for column in inspect(conn).get_columns(item_table.name)}
+        for table in PARTITIONED_TABLES:
+            old = f'{table.name}_unpartitioned'
+            conn.execute(text(f'ALTER TABLE "{table.name}" RENAME TO "{old}"'))
+            for index in conn.execute(text('SELECT indexname FROM pg_indexes WHERE tablename = :t'), {'t': old}).scalars():
+                conn.execute(text(f'ALTER INDEX "{index}" RENAME TO "{index}_unpartitioned"'))
+
+        first = conn.execute(text(f'SELECT min(created_at) FROM "{order_table.name}_unpartitioned"')).scalar()
+        for table in PARTITIONED_TABLES:
+            conn.execute(_partitioned_ddl(table))
+            conn.execute(text(f'CREATE TABLE "{table.name}_default" PARTITION OF "{table.name}" DEFAULT'))
+        ensure_partitions(conn, months_ahead, first_month=first)
+
+        conn.execute(text(
+            f'INSERT INTO "{order_table.name}" ({_columns(order_table)}) '
+            f'SELECT ' + ', '.join(
+                'COALESCE(created_at, now())' if column.name == 'created_at' else f'"{column.name}"'
+                for column in order_table.columns
+            ) + f' FROM "{order_table.name}_unpartitioned"'
+        ))
+        item_columns = ', '.join(
+            'o.created_at' if column.name == 'created_at' else f'i."{column.name}"'
+            for column in item_table.columns
+            if column.name in existing_item_columns or column.name == 'created_at'
+        )
+        conn.execute(text(
+            f'INSERT INTO "{item_table.name}" ('
+            + ', '.join(f'"{c.name}"' for c in item_table.columns if c.name in existing_item_columns or c.name == 'created_at')
+            + f') SELECT {item_columns} FROM "{item_table.name}_unpartitioned" i '
+            f'JOIN "{order_table.name}" o ON o.id = i.order_id'
+        ))
+        for table in PARTITIONED_TABLES:
+            conn.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('\"{table.name}\"', 'id'), "
+                f'COALESCE((SELECT max(id) FROM "{table.name}"), 0) + 1, false)'
+            ))
+        for table in reversed(PARTITIONED_TABLES):
+            conn.execute(text(f'DROP TABLE "{table.name}_unpartitioned"'))
+    return True
+
+
+def _write_archive_file(conn, archive_dir, name, query, params=None):
+    """Write the query's rows to a new ``<name>-<timestamp>.csv.gz``; None if there are none.
+
+    Files are opened in exclusive mode, so an earlier archive is never overwritten.
+    """
+    result = conn.execute(text(query).execution_options(yield_per=5000), params or {})
+    first = result.fetchone()
+    if first is None:
+        result.close()
+        return None
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f'{name}-{datetime.utcnow():%Y%m%dT%H%M%S%f}.csv.gz')
+    with gzip.open(path, 'xt', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(result.keys())
+        writer.writerow(first)
+        for row in result:
+            writer.writerow(row)
+    return path
+
+
+def _ensure_archive_table(conn, table):
+    archive = f'{table.name}_archive'
+    if _is_postgres(conn):
+        conn.execute(text(f'CREATE TABLE IF NOT EXISTS "{archive}" (LIKE "{table.name}" INCLUDING DEFAULTS)'))
+        # Archived rows only ever arrive in date order, so a BRIN index
+        # keeps date lookups cheap at a tiny fraction of a b-tree's size.
+        conn.execute(text(f'CREATE INDEX IF NOT EXISTS "ix_{archive}_created_at" ON "{archive}" USING brin (created_at)'))
+    else:
+        conn.execute(text(f'CREATE TABLE IF NOT EXISTS "{archive}" AS SELECT {_columns(table)} FROM "{table.name}" WHERE 0'))
+    return archive
+
+
+@contextmanager
+def _archive_transaction():
+    """Transaction plus the list of archive files written in it.
+
+    The files are deleted again if the transaction does not commit, so a
+    failed run leaves no copy of rows that are still in the live tables.
+    """
+    written = []
+    try:
+        with db.engine.begin() as conn:
+            yield conn, written
+    except BaseException:
+        for path in written:
+            os.remove(path)
+        raise
+
+
+def _archive_rows(conn, written, table, archive_dir, name, select_from, params=None):
+    """Archive ``SELECT <columns> <select_from>``; returns a description or None if empty."""
+    if archive_dir:
+        path = _write_archive_file(conn, archive_dir, name, f'SELECT {_columns(table)} {select_from}', params)
+        if path:
+            written.append(path)
+        return path
+    archive = _ensure_archive_table(conn, table)
+    count = conn.execute(text(
+        f'INSERT INTO "{archive}" ({_columns(table)}) SELECT {_columns(table)} {select_from}'
+    ), params or {}).rowcount
+    return f'{count} {table.name} rows from {name} -> {archive}' if count else None
+
+
+def archive_orders(keep_months=24, archive_dir=None):
+    """Move orders older than ``keep_months`` whole months out of the live tables.
+
+    On PostgreSQL whole monthly partitions are detached and either copied to
+    ``<table>_archive`` or written to ``archive_dir`` as gzipped CSV, then
+    dropped, each partition in its own transaction. Elsewhere the old rows
+    are moved with INSERT ... SELECT/DELETE in one transaction.
+    Returns a list of what was archived.
+    """
+    cutoff = _add_months(_month_start(datetime.utcnow()), -keep_months)
+    archived = []
+    with db.engine.connect() as conn:
+        partitioned = _is_postgres(conn) and _relkind(conn, Order.__tablename__) == 'p'
+        if partitioned:
+            expired = [
+                (table, name)
+                for table in reversed(PARTITIONED_TABLES)
+                for month, name in sorted(list_partitions(conn, table.name).items())
+                if _add_months(month, 1) <= cutoff
+            ]
+
+    if partitioned:
+        for table, name in expired:
+            with _archive_transaction() as (conn, written):
+                conn.execute(text(f'ALTER TABLE "{table.name}" DETACH PARTITION "{name}"'))
+                entry = _archive_rows(conn, written, table, archive_dir, name, f'FROM "{name}" ORDER BY id')
+                conn.execute(text(f'DROP TABLE "{name}"'))
+            if entry:
+                archived.append(entry)
+        return archived
+
+    order_table, item_table = PARTITIONED_TABLES
+    old_orders = f'SELECT id FROM "{order_table.name}" WHERE created_at < :cutoff'
+    moves = [
+        (item_table, f'FROM "{item_table.name}" WHERE order_id IN ({old_orders})'),
+        (order_table, f'FROM "{order_table.name}" WHERE created_at < :cutoff'),
+    ]
+    label = f'before_{cutoff:%Y_%m}'
+    entries = []
+    with _archive_transaction() as (conn, written):
+        for table, where in moves:
+            entries.append(_archive_rows(
+                conn, written, table, archive_dir, f'{table.name}_{label}', where, {'cutoff': cutoff}
+            ))
+            conn.execute(text(f'DELETE {where}'), {'cutoff': cutoff})
+    archived.extend(entry for entry in entries if entry)
+    return archived
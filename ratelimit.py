@@ -0,0 +1,225 @@
+import threading
+import time
+
+from flask import request, jsonify, make_response
+from sqlalchemy import (
+    MetaData, Table, Column, String, Float, create_engine, case, delete, select, insert, update
+)
+from sqlalchemy.exc import IntegrityError
+
+
+class MemoryBackend:
+    """Token buckets held in this process only."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate, now):
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                return True, 0
+            self._buckets[key] = (tokens, now)
+            return False, (1 - tokens) / rate
+
+    def prune(self, before):
+        with self._lock:
+            for key in [key for key, (_, updated) in self._buckets.items() if updated <= before]:
+                del self._buckets[key]
+
+
+class SQLBackend:
+    """Token buckets shared by every worker through a SQL table.
+
+    Refill and consume happen in a single conditional UPDATE, so concurrent
+    workers never read and write a bucket in separate steps.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        metadata = MetaData()
+        self.table = Table(
+            'rate_limit_buckets', metadata,
+            Column('bucket_key', String(200), primary_key=True),
+            Column('tokens', Float, nullable=False),
+            Column('updated', Float, nullable=False),
+        )
+        metadata.create_all(engine)
+
+    def take(self, key, capacity, rate, now):
+        t = self.table
+        refilled = t.c.tokens + (now - t.c.updated) * rate
+        refilled = case((refilled > capacity, capacity), else_=refilled)
+
+        with self.engine.begin() as conn:
+            result = conn.execute(
+                update(t)
+                .where(t.c.bucket_key == key, refilled >= 1)
+                .values(tokens=refilled - 1, updated=now)
+            )
+            if result.rowcount:
+                return True, 0
+
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(insert(t).values(bucket_key=key, tokens=capacity - 1, updated=now))
+            return True, 0
+        except IntegrityError:
+            pass
+
+        with self.engine.connect() as conn:
+            tokens = conn.execute(select(refilled).where(t.c.bucket_key == key)).scalar() or 0
+        return False, max(1 - tokens, 0) / rate
+
+    def prune(self, before):
+        with self.engine.begin() as conn:
+            conn.execute(delete(self.table).where(self.table.c.updated <= before))
+
+
+class RateLimiter:
+    """Per-IP and per-route token buckets plus load shedding.
+
+    Rules live in ``app.config['RATELIMIT_RULES']`` keyed by endpoint name::
+
+        'contact': {'per_ip': (3, 300), 'per_route': (30, 60), 'gateway': True}
+
+    ``per_ip`` is a bucket per client address on that route, ``per_route`` is
+    a single bucket shared by all clients, both as (requests, seconds). Only
+    the rule's ``methods`` are limited (default POST), so viewing a form
+    costs nothing. Endpoints without a rule (catalog pages, static files) are
+    never limited or shed.
+
+    Limited endpoints are shed with 503 when the request waited longer than
+    ``RATELIMIT_MAX_QUEUE_WAIT`` seconds before reaching the app, measured
+    from the ``X-Request-Start`` header set by the proxy, or when this
+    worker already has ``RATELIMIT_MAX_GATEWAY`` requests on ``gateway``
+    routes (payment/SMTP calls) in flight. Keep the latter below the
+    worker's thread count so catalog requests always have a free thread.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self._gateway = 0
+        self._pruned = time.time()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RATELIMIT_ENABLED', True)
+        app.config.setdefault('RATELIMIT_STORAGE_URL', 'memory://')
+        app.config.setdefault('RATELIMIT_RULES', {})
+        app.config.setdefault('RATELIMIT_MAX_QUEUE_WAIT', 0)
+        app.config.setdefault('RATELIMIT_MAX_GATEWAY', 0)
+        app.config.setdefault('RATELIMIT_SHED_RETRY_AFTER', 5)
+        app.config.setdefault('RATELIMIT_PRUNE_INTERVAL', 300)
+
+        self.app = app
+        self.backend = self._create_backend(app.config['RATELIMIT_STORAGE_URL'])
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+        app.extensions['ratelimiter'] = self
+
+    def _create_backend(self, url):
+        if not url or url == 'memory://':
+            return MemoryBackend()
+        if url == 'database':
+            # Reuse the application's database; the engine is only available
+            # inside an app context.
+            from models import db
+            with self.app.app_context():
+                return SQLBackend(db.engine)
+        return SQLBackend(create_engine(url))
+
+    def _rule(self):
+        if not self.app.config['RATELIMIT_ENABLED'] or request.endpoint is None:
+            return None
+        rule = self.app.config['RATELIMIT_RULES'].get(request.endpoint)
+        if rule is None or request.method not in rule.get('methods', ('POST',)):
+            return None
+        return rule
+
+    def _queue_wait(self, now):
+        """Seconds since the proxy received the request, or 0 if unknown.
+
+        Accepts ``t=<seconds|milliseconds|microseconds>`` or a bare number,
+        the formats written by nginx (``t=${msec}``), Heroku and Render.
+        """
+        value = request.headers.get('X-Request-Start', '').strip()
+        if value.startswith('t='):
+            value = value[2:]
+        try:
+            started = float(value)
+        except ValueError:
+            return 0
+        while started > now * 100:
+            started /= 1000
+        return max(0, now - started)
+
+    def _prune(self, now):
+        interval = self.app.config['RATELIMIT_PRUNE_INTERVAL']
+        with self._lock:
+            if not interval or now - self._pruned < interval:
+                return
+            self._pruned = now
+        # A bucket left alone for its longest period has refilled to full and
+        # is the same as a missing one, so idle client buckets are dropped.
+        periods = [
+            period for rule in self.app.config['RATELIMIT_RULES'].values()
+            for name in ('per_ip', 'per_route') if name in rule
+            for _, period in [rule[name]]
+        ]
+        if periods:
+            self.backend.prune(now - max(periods))
+
+    def _before_request(self):
+        rule = self._rule()
+        if rule is None:
+            return None
+
+        now = time.time()
+        gateway = rule.get('gateway', False)
+        max_wait = self.app.config['RATELIMIT_MAX_QUEUE_WAIT']
+        max_gateway = self.app.config['RATELIMIT_MAX_GATEWAY']
+        overloaded = bool(max_wait) and self._queue_wait(now) > max_wait
+        if gateway and not overloaded:
+            with self._lock:
+                overloaded = bool(max_gateway) and self._gateway >= max_gateway
+                if not overloaded:
+                    self._gateway += 1
+                    request.environ['ratelimit.gateway'] = True
+        if overloaded:
+            return self._reject(503, self.app.config['RATELIMIT_SHED_RETRY_AFTER'],
+                                'El servidor está ocupado, por favor intenta de nuevo en unos segundos.')
+
+        self._prune(now)
+        checks = []
+        if 'per_ip' in rule:
+            checks.append((f'ip:{request.endpoint}:{request.remote_addr}', rule['per_ip']))
+        if 'per_route' in rule:
+            checks.append((f'route:{request.endpoint}', rule['per_route']))
+        for key, (capacity, period) in checks:
+            allowed, retry_after = self.backend.take(key, capacity, capacity / period, now)
+            if not allowed:
+                return self._reject(429, retry_after,
+                                    'Demasiadas solicitudes, por favor espera un momento antes de intentar de nuevo.')
+        return None
+
+    def _teardown_request(self, exc=None):
+        if not request.environ.pop('ratelimit.gateway', False):
+            return
+        with self._lock:
+            self._gateway -= 1
+
+    def _reject(self, status, retry_after, message):
+        if request.accept_mimetypes.best == 'application/json':
+            response = jsonify({'error': message})
+        else:
+            response = make_response(message)
+            response.mimetype = 'text/plain'
+        response.status_code = status
+        response.headers['Retry-After'] = str(max(1, int(retry_after + 0.999)))
+        return response
@@ -0,0 +1,127 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select, delete, insert
+from sqlalchemy.orm import aliased
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, Order, OrderItem, SiteConfig, ProductPairCount, ProductRecommendation
+
+WATERMARK_KEY = 'recommendations_last_order_id'
+TOP_K = 6
+# Orders younger than this may still be inside an open transaction with a
+# lower id than one already committed; leave them for the next refresh.
+SETTLE_DELAY = timedelta(minutes=5)
+
+
+def _upsert(dialect_name):
+    if dialect_name == 'postgresql':
+        return postgresql.insert
+    if dialect_name == 'sqlite':
+        return sqlite.insert
+    raise RuntimeError(f'Recomendaciones no soportadas para {dialect_name}')
+
+
+def _add_pair_counts(upsert, low, high):
+    """Add co-occurrence counts for orders with low < id <= high in one statement."""
+    # The batch's date span lets PostgreSQL skip the monthly partitions of
+    # orders and order_items that cannot hold these ids.
+    first, last = db.session.execute(
+        select(func.min(Order.created_at), func.max(Order.created_at))
+        .where(Order.id > low, Order.id <= high)
+    ).one()
+    if first is None:
+        return
+    a = aliased(OrderItem)
+    b = aliased(OrderItem)
+    pairs = (
+        select(a.product_id, b.product_id, func.count(func.distinct(a.order_id)))
+        .join(b, (b.order_id == a.order_id) & (b.product_id != a.product_id))
+        .join(Order, Order.id == a.order_id)
+        .where(
+            a.order_id > low, a.order_id <= high, Order.status != 'cancelled',
+            Order.created_at.between(first, last),
+            a.created_at.between(first, last),
+            b.created_at.between(first, last),
+        )
+        .group_by(a.product_id, b.product_id)
+    )
+    stmt = upsert(ProductPairCount).from_select(['product_id', 'related_id', 'orders'], pairs)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['product_id', 'related_id'],
+        set_={'orders': ProductPairCount.orders + stmt.excluded.orders},
+    ))
+
+
+def _rebuild_top_k(product_ids, top_k):
+    ranked = select(
+        ProductPairCount.product_id,
+        func.row_number().over(
+            partition_by=ProductPairCount.product_id,
+            order_by=(ProductPairCount.orders.desc(), ProductPairCount.related_id),
+        ).label('rank'),
+        ProductPairCount.related_id,
+        ProductPairCount.orders,
+    ).where(ProductPairCount.product_id.in_(product_ids)).subquery()
+
+    db.session.execute(
+        delete(ProductRecommendation).where(ProductRecommendation.product_id.in_(product_ids))
+    )
+    db.session.execute(
+        insert(ProductRecommendation).from_select(
+            ['product_id', 'rank', 'related_id', 'score'],
+            select(ranked.c.product_id, ranked.c.rank, ranked.c.related_id, ranked.c.orders)
+            .where(ranked.c.rank <= top_k),
+        )
+    )
+
+
+def refresh_recommendations(top_k=TOP_K, batch_size=50000, chunk_size=1000):
+    """Fold orders placed since the last run into the pair counts.
+
+    Counts are accumulated inside the database batch by batch; only the
+    products that appear in the new orders get their top-k list rebuilt, in
+    the same transaction that advances the watermark, so an interrupted run
+    never leaves stale lists behind. A refresh with no new orders costs two
+    small queries. Returns the number of orders processed.
+    """
+    config = SiteConfig.query.filter_by(config_key=WATERMARK_KEY).first()
+    if not config:
+        config = SiteConfig(config_key=WATERMARK_KEY, config_value='0')
+        db.session.add(config)
+    last_id = int(config.config_value or 0)
+
+    high_id = db.session.scalar(
+        select(func.max(Order.id)).where(Order.created_at <= datetime.utcnow() - SETTLE_DELAY)
+    ) or 0
+    if high_id <= last_id:
+        db.session.commit()
+        return 0
+
+    upsert = _upsert(db.engine.dialect.name)
+    processed = db.session.scalar(
+        select(func.count(Order.id)).where(Order.id > last_id, Order.id <= high_id)
+    )
+
+    while last_id < high_id:
+        batch_high = min(last_id + batch_size, high_id)
+        _add_pair_counts(upsert, last_id, batch_high)
+        affected = sorted(db.session.scalars(
+            select(OrderItem.product_id.distinct())
+            .where(OrderItem.order_id > last_id, OrderItem.order_id <= batch_high)
+        ))
+        for start in range(0, len(affected), chunk_size):
+            _rebuild_top_k(affected[start:start + chunk_size], top_k)
+        last_id = batch_high
+        config.config_value = str(last_id)
+        db.session.commit()
+
+    return processed
+
+
+def rebuild_recommendations(top_k=TOP_K, batch_size=50000):
+    """Drop everything and recompute from the full order history."""
+    db.session.execute(delete(ProductRecommendation))
+    db.session.execute(delete(ProductPairCount))
+    SiteConfig.query.filter_by(config_key=WATERMARK_KEY).delete()
+    db.session.commit()
+    return refresh_recommendations(top_k=top_k, batch_size=batch_size)
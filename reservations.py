@@ -0,0 +1,199 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, delete, insert, select, update
+
+from models import db, Product, StockReservation
+
+
+def _per_product(quantities):
+    return case(quantities, value=Product.id)
+
+
+def _adjust_products(rows, **changes):
+    """Apply per-product quantity deltas to several products in one UPDATE.
+
+    ``rows`` are (product_id, quantity) pairs and ``changes`` maps a column
+    name to +1 or -1, e.g. ``reserved=-1`` releases the quantities. Holds
+    alone leave ``updated_at`` untouched so they do not invalidate the
+    catalog caches keyed on ``catalog_version()``; stock changes bump it.
+    """
+    quantities = {}
+    for product_id, quantity in rows:
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    if not quantities:
+        return quantities
+    delta = _per_product(quantities)
+    values = {name: getattr(Product, name) + sign * delta for name, sign in changes.items()}
+    if 'stock' not in changes:
+        values['updated_at'] = Product.updated_at
+    db.session.execute(
+        update(Product)
+        .where(Product.id.in_(quantities))
+        .values(values)
+        .execution_options(synchronize_session=False)
+    )
+    return quantities
+
+
+def release_hold(token):
+    rows = db.session.execute(
+        delete(StockReservation)
+        .where(StockReservation.token == token)
+        .returning(StockReservation.product_id, StockReservation.quantity)
+    ).all()
+    _adjust_products(rows, reserved=-1)
+
+
+def hold_cart(token, quantities, ttl):
+    """Reserve ``{product_id: quantity}`` for ``token`` until ``ttl`` from now.
+
+    Any previous hold for the token is replaced. Every line is reserved by a
+    single conditional UPDATE. Returns ``(held, shortfalls)``: if a product
+    does not have enough available stock nothing is held, ``held`` is False
+    and ``shortfalls`` lists the products that fell short (empty when a
+    concurrent release freed the stock in the meantime).
+    """
+    release_hold(token)
+    if not quantities:
+        db.session.commit()
+        return False, []
+
+    requested = _per_product(quantities)
+    result = db.session.execute(
+        update(Product)
+        .where(Product.id.in_(quantities), Product.stock - Product.reserved >= requested)
+        .values(reserved=Product.reserved + requested, updated_at=Product.updated_at)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != len(quantities):
+        db.session.rollback()
+        return False, Product.query.filter(
+            Product.id.in_(quantities), Product.stock - Product.reserved < requested
+        ).all()
+
+    expires_at = datetime.utcnow() + ttl
+    db.session.execute(insert(StockReservation), [
+        {'token': token, 'product_id': product_id, 'quantity': quantity, 'expires_at': expires_at}
+        for product_id, quantity in quantities.items()
+    ])
+    db.session.commit()
+    return True, []
+
+
+def extend_hold(token, ttl):
+    """Push back the expiry of a live hold and return ``{product_id: quantity}``."""
+    now = datetime.utcnow()
+    db.session.execute(
+        update(StockReservation)
+        .where(StockReservation.token == token, StockReservation.expires_at > now)
+        .values(expires_at=now + ttl)
+    )
+    held = dict(db.session.execute(
+        select(StockReservation.product_id, StockReservation.quantity)
+        .where(StockReservation.token == token, StockReservation.expires_at > now)
+    ).all())
+    db.session.commit()
+    return held
+
+
+def convert_hold(token):
+    """Turn a hold into a sale: the reserved units leave stock for good.
+
+    Returns ``{product_id: quantity}`` converted; empty if the hold had
+    already expired and been released by the sweeper. The caller commits.
+    """
+    rows = db.session.execute(
+        delete(StockReservation)
+        .where(StockReservation.token == token)
+        .returning(StockReservation.product_id, StockReservation.quantity)
+    ).all()
+    return _adjust_products(rows, stock=-1, reserved=-1)
+
+
+def complete_sale(token, quantities):
+    """Take a paid cart ``{product_id: quantity}`` out of stock.
+
+    Units still held are converted; units whose hold expired while the
+    customer was paying are decremented directly, since the sale already
+    happened. The caller commits.
+    """
+    converted = convert_hold(token)
+    _adjust_products([
+        (product_id, quantity - converted.get(product_id, 0))
+        for product_id, quantity in quantities.items()
+        if quantity > converted.get(product_id, 0)
+    ], stock=-1)
+    return converted
+
+
+def release_expired(batch_size=500):
+    """Release expired holds in batches; returns the number of holds released."""
+    released = 0
+    while True:
+        expired = (
+            select(StockReservation.id)
+            .where(StockReservation.expires_at <= datetime.utcnow())
+            .order_by(StockReservation.expires_at)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        rows = db.session.execute(
+            delete(StockReservation)
+            .where(StockReservation.id.in_(expired.scalar_subquery()))
+            .returning(StockReservation.product_id, StockReservation.quantity)
+        ).all()
+        _adjust_products(rows, reserved=-1)
+        db.session.commit()
+        released += len(rows)
+        if len(rows) < batch_size:
+            return released
+
+
+class ReservationSweeper:
+    """Background thread in each worker that releases expired holds.
+
+    The thread is started on the first request of every process, so it also
+    runs in gunicorn workers forked from a preloaded master.
+    """
+
+    def __init__(self, app=None):
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RESERVATION_TTL_MINUTES', 15)
+        app.config.setdefault('RESERVATION_SWEEP_INTERVAL', 60)
+        app.config.setdefault('RESERVATION_SWEEP_BATCH', 500)
+        self.app = app
+        app.before_request(self._ensure_running)
+        app.extensions['reservation_sweeper'] = self
+
+    @property
+    def ttl(self):
+        return timedelta(minutes=self.app.config['RESERVATION_TTL_MINUTES'])
+
+    def _ensure_running(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='reservation-sweeper', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.app.config['RESERVATION_SWEEP_INTERVAL'])
+            with self.app.app_context():
+                try:
+                    released = release_expired(self.app.config['RESERVATION_SWEEP_BATCH'])
+                    if released:
+                        self.app.logger.info('Released %s expired stock reservations', released)
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception('Error releasing expired stock reservations')
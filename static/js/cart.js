@@ -0,0 +1,85 @@
+// Submits cart forms with fetch() and patches the page from the JSON reply
+// (changed line, totals and badge) instead of reloading the whole cart.
+// Without JavaScript, or if the request fails, the forms post normally.
+(function () {
+    function formatMoney(amount) {
+        return '$' + amount.toFixed(2);
+    }
+
+    function showMessage(message, category) {
+        var container = document.querySelector('.flash-messages');
+        if (!container) {
+            container = document.createElement('div');
+            container.className = 'flash-messages';
+            document.querySelector('main').before(container);
+        }
+        container.innerHTML = '';
+        var alert = document.createElement('div');
+        alert.className = 'alert alert-' + category;
+        alert.textContent = message + ' ';
+        var close = document.createElement('button');
+        close.className = 'close-alert';
+        close.innerHTML = '&times;';
+        close.onclick = function () { alert.remove(); };
+        alert.appendChild(close);
+        container.appendChild(alert);
+    }
+
+    function applyUpdate(form, data) {
+        document.querySelectorAll('[data-cart-count]').forEach(function (badge) {
+            badge.textContent = data.cart_count;
+            badge.hidden = data.cart_count === 0;
+        });
+        document.querySelectorAll('[data-cart-total]').forEach(function (total) {
+            total.textContent = formatMoney(data.total);
+        });
+
+        var line = form.closest('.cart-item');
+        if (line) {
+            if (data.quantity === 0) {
+                line.remove();
+            } else {
+                line.querySelector('[data-cart-subtotal]').textContent = formatMoney(data.subtotal);
+                line.querySelector('input[name="quantity"]').value = data.quantity;
+            }
+            if (data.cart_count === 0) {
+                window.location.reload();
+                return;
+            }
+        }
+        showMessage(data.message, data.ok ? 'success' : 'error');
+    }
+
+    function submit(form) {
+        fetch(form.action, {
+            method: 'POST',
+            body: new FormData(form),
+            headers: { 'Accept': 'application/json' },
+            credentials: 'same-origin'
+        }).then(function (response) {
+            if (!response.headers.get('Content-Type').startsWith('application/json')) {
+                throw new Error('unexpected response');
+            }
+            return response.json();
+        }).then(function (data) {
+            if (data.error) {
+                // Rate limited or shed; nothing changed on the server.
+                showMessage(data.error, 'error');
+                return;
+            }
+            applyUpdate(form, data);
+        }).catch(function () {
+            form.submit();
+        });
+    }
+
+    document.querySelectorAll('form[data-cart-action]').forEach(function (form) {
+        form.addEventListener('submit', function (event) {
+            event.preventDefault();
+            submit(form);
+        });
+        form.querySelectorAll('[data-submit-on-change]').forEach(function (input) {
+            input.addEventListener('change', function () { submit(form); });
+        });
+    });
+})();